@@ -23,21 +23,18 @@
 # SOFTWARE.
 #
 
-import base64
 import os
 import sys
+from binascii import b2a_base64
 from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Optional, Sequence, Tuple, Union
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
 
-import appdirs
 import click
-import pzp
 from click.core import Command, Context
 from click.formatting import HelpFormatter
-from click.utils import make_str
-from pzp.ansi import PURPLE, RESET
 
 from .secret import Secret
 from .token import (
@@ -45,6 +42,7 @@ from .token import (
     DEFAULT_ALGORITHM,
     DEFAULT_DIGITS,
     DEFAULT_PERIOD,
+    TOKEN_TYPE_BY_NAME,
     Token,
     TokenDb,
     TokenType,
@@ -62,16 +60,36 @@ __all__ = [
 ]
 
 DESCRIPTION = "FreakOTP is a command line two-factor authentication application."
-CONFIG_DIR = Path(appdirs.user_config_dir(appname="FreakOTP"))
-DEFAULT_DB = CONFIG_DIR / "freakotp.db"
+
+TITLE_FORMAT = click.style("{:66}", bg="blue", fg="white", bold=True)
+TOKEN_TYPES = tuple(TOKEN_TYPE_BY_NAME)
+ALGORITHM_NAMES = tuple(ALGORITHMS)
 
 EXIT_SUCCESS = 0
 EXIT_FAILURE = 1
 EXIT_PARSER_ERROR = 2
 
 
+@lru_cache(maxsize=1)
+def _default_db() -> Path:
+    "Default database path, in the user config directory"
+    import appdirs
+
+    return Path(appdirs.user_config_dir(appname="FreakOTP")) / "freakotp.db"
+
+
+def __getattr__(name: str) -> Any:
+    # CONFIG_DIR and DEFAULT_DB are computed on first access, appdirs is not imported at startup
+    if name == "DEFAULT_DB":
+        return _default_db()
+    elif name == "CONFIG_DIR":
+        return _default_db().parent
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 @dataclass
 class KeyBinding:
+    __slots__ = ("binding", "label")
     binding: str
     label: str
 
@@ -88,11 +106,13 @@ class KeyBinding:
 
 class FreakOTPGroup(click.Group):
     def resolve_command(self, ctx: Context, args: List[str]) -> Tuple[Optional[str], Optional[Command], List[str]]:
-        is_cmd = args and make_str(args[0]).startswith(".")
-        if is_cmd:
+        command = self.commands.get(args[0]) if args else None
+        if command is not None:
+            return args[0], command, args[1:]
+        elif args and args[0].startswith("."):  # unknown command, let click report the error
             return super().resolve_command(ctx, args)
         else:
-            return ".default", self.get_command(ctx, ".default"), args
+            return ".default", self.commands[".default"], args
 
     def format_usage(self, ctx: Context, formatter: HelpFormatter) -> None:
         formatter.write_usage(ctx.command_path, "[OPTIONS] [COMMAND|[TOKENS]...] [ARGS]...")
@@ -100,7 +120,7 @@ class FreakOTPGroup(click.Group):
 
 @click.group("cli", invoke_without_command=True, cls=FreakOTPGroup, help=DESCRIPTION)
 @click.version_option(__version__)
-@click.option("--db", help="Database path.", default=DEFAULT_DB, type=click.Path(), envvar="FREAKOTP_DB")
+@click.option("--db", help="Database path.", default=lambda: str(_default_db()), type=str, metavar="PATH", envvar="FREAKOTP_DB")
 @click.option("-v", "--verbose", help="Verbose output.", default=False, is_flag=True)
 @click.option("-c", "--counter", help="HOTP counter value.", type=click.INT)
 @click.option("-t", "--time", help="TOTP timestamp.", type=click.DateTime(formats=["%Y-%m-%dT%H:%M:%S"]), default=None)
@@ -114,6 +134,7 @@ def cli(ctx: Context, db: str, verbose: bool, counter: Optional[int], time: Opti
 
 
 class FreakOTP(object):
+    __slots__ = ("verbose", "token_db", "counter", "timestamp", "copy")
     verbose: bool
     token_db: TokenDb
     counter: Optional[int]
@@ -128,31 +149,44 @@ class FreakOTP(object):
         "edit-token": KeyBinding(binding="ctrl-o", label="Edit"),
         "delete-token": KeyBinding(binding="ctrl-x", label="Delete"),
     }
+    menu_keys_binding: Dict[str, Sequence[str]] = {k: [v.binding] for k, v in key_bindings.items() if v.bind}
 
     def __init__(
         self,
-        db_filename: Path = DEFAULT_DB,
+        db_filename: Optional[Path] = None,
         verbose: bool = False,
         counter: Optional[int] = None,
         timestamp: Optional[datetime] = None,
         copy: bool = True,
     ):
         self.verbose = verbose
-        self.token_db = TokenDb(db_filename)
+        self.token_db = TokenDb(db_filename or _default_db())
         self.counter = counter
         self.timestamp = timestamp
         self.copy = copy
 
     def menu(self) -> None:
         "Display menu"
+        import pzp
+        from pzp.ansi import PURPLE, RESET
+
+        # The menu is redrawn on every keystroke and refresh, format each token only once
+        labels: Dict[Token, str] = {}
+
+        def format_token(token: Token) -> str:
+            label = labels.get(token)
+            if label is None:
+                label = labels[token] = f"{token.rowid:2d}: {token}"
+            return label
+
         try:
             token = pzp.pzp(
                 self.token_db.get_tokens,
-                format_fn=lambda item: f"{item.rowid:2d}: {item}",
+                format_fn=format_token,
                 fullscreen=False,
                 layout="reverse-list",
                 header_str="  ".join([f"{PURPLE}{x}{RESET} {x.label}" for x in self.key_bindings.values()]),
-                keys_binding=(dict([(k, [v.binding]) for k, v in self.key_bindings.items() if v.bind])),
+                keys_binding=self.menu_keys_binding,
                 auto_refresh=1,
             )
             if token is not None:
@@ -184,49 +218,57 @@ class FreakOTP(object):
             tokens_list: List[Token] = self.find(tokens)
         else:
             tokens_list = self.token_db.get_tokens()
+        if calculate:
+            otps = self.token_db.calculate_all(tokens_list, timestamp=self.timestamp, counter=self.counter)
+        lines: List[str] = []
         for i, token in enumerate(tokens_list):
+            name = str(token)
+            if long_format:
+                name = f"{token.rowid:>4} {token.type.value:7} {token.algorithm:6} {token.digits:>2} {token.period:>3} {name}"
             if calculate:
-                try:
-                    otp = token.calculate(timestamp=self.timestamp, counter=self.counter)
-                    if i == 0:
-                        self.copy_into_clipboard(otp)
-                    if token.type == TokenType.HOTP and token.counter:
-                        counter = f"({token.counter})"
-                    else:
-                        counter = ""
-                    if long_format:
-                        print(
-                            f"{otp:8} {token.rowid:>4} {token.type.value:7} {token.algorithm:6} {token.digits:>2} {token.period:>3} {token} {counter}"
-                        )
-                    else:
-                        print(f"{otp} {token} {counter}")
-                except ImportError:
-                    pass
-            elif long_format:
-                print(f"{token.rowid:>4} {token.type.value:7} {token.algorithm:6} {token.digits:>2} {token.period:>3} {token}")
+                otp = otps[i]
+                if otp is None:
+                    continue
+                if i == 0:
+                    self.copy_into_clipboard(otp)
+                if token.type == TokenType.HOTP and token.counter:
+                    counter = f"({token.counter})"
+                else:
+                    counter = ""
+                if long_format:
+                    lines.append(f"{otp:8} {name} {counter}\n")
+                else:
+                    lines.append(f"{otp} {name} {counter}\n")
             else:
-                print(token)
+                lines.append(f"{name}\n")
+        sys.stdout.write("".join(lines))
 
     def get_token(self, index: int) -> Token:
         "Get token by index"
-        try:
-            return self.token_db.get_tokens()[index - 1]
-        except Exception:
+        token = self.token_db.get_token_at(index)
+        if token is None:
             raise KeyError(index)
+        return token
+
+    def get_token_by_rowid(self, rowid: int) -> Token:
+        "Get token by rowid"
+        token = self.token_db.get_token_by_rowid(rowid)
+        if token is None:
+            raise KeyError(rowid)
+        return token
 
     def find(self, arg: Union[str, Token, Sequence[str], Sequence[Token]]) -> List[Token]:
         args_list: Sequence[Union[str, Token]] = arg if isinstance(arg, (tuple, list)) else [arg]
-        result: List[Token] = [x for x in args_list if isinstance(x, Token)]
-        labels: List[str] = [x for x in args_list if isinstance(x, str)]
-        for label in labels:
-            if label.startswith("otpauth://"):
-                result.append(Token(uri=label))
-        for token in self.token_db.get_tokens():
-            tmp = str(token).lower().strip()
-            for label in labels:
-                if label.lower() in tmp:
-                    result.append(token)
-                    break
+        result: List[Token] = []
+        labels: List[str] = []
+        for x in args_list:
+            if isinstance(x, Token):
+                result.append(x)
+            elif x.startswith("otpauth://"):
+                result.append(Token(uri=x))
+            else:
+                labels.append(x)
+        result.extend(self.token_db.find_by_name(labels))
         return result
 
     def import_json(self, json_filename: Path, delete_existing_data: bool = False) -> int:
@@ -253,6 +295,8 @@ class FreakOTP(object):
         secret_str: Optional[str] = None,
     ) -> Token:
         "Add a token to the FreakOTP database"
+        import pzp
+
         self.title("Add token")
         if not secret_str and not uri:
             uri_or_secret = pzp.prompt("Secret key Base32 or URI (otpauth://)", show_default=False).strip()
@@ -266,14 +310,14 @@ class FreakOTP(object):
                 type_str = pzp.pzp(
                     header_str="Token type:",
                     layout="reverse-list",
-                    candidates=TokenType._member_names_,
+                    candidates=TOKEN_TYPES,
                     fullscreen=False,
                 )
                 print(f"Token type: {type_str}")
                 algorithm = pzp.pzp(
                     header_str="Algorithm:",
                     layout="reverse-list",
-                    candidates=list(ALGORITHMS),
+                    candidates=ALGORITHM_NAMES,
                     fullscreen=False,
                 )
                 print(f"Algorithm: {algorithm}")
@@ -284,7 +328,7 @@ class FreakOTP(object):
                     period = pzp.prompt("Time-step duration in seconds", type=click.INT, default=period)
         token = Token(
             uri=uri,
-            type=TokenType[type_str] if type_str else None,
+            type=TOKEN_TYPE_BY_NAME[type_str] if type_str else None,
             algorithm=algorithm,
             counter=counter,
             digits=digits,
@@ -304,6 +348,8 @@ class FreakOTP(object):
 
     def edit_token(self, token: Token) -> Token:
         "Edit a token"
+        import pzp
+
         self.title(f"Edit token {token}")
         token.secret = Secret.from_base32(pzp.prompt("Secret", default=token.secret.to_base32()))
         token.issuer = pzp.prompt("Issuer", default=token.issuer)
@@ -311,16 +357,16 @@ class FreakOTP(object):
         type_str = pzp.pzp(
             header_str="Token type:",
             layout="reverse-list",
-            candidates=TokenType._member_names_,
+            candidates=TOKEN_TYPES,
             input=token.type.value,
             fullscreen=False,
         )
-        token.type = TokenType[type_str] if type_str else None
+        token.type = TOKEN_TYPE_BY_NAME[type_str] if type_str else None
         print(f"Token type: {type_str}")
         token.algorithm = pzp.pzp(
             header_str="Algorithm:",
             layout="reverse-list",
-            candidates=list(ALGORITHMS),
+            candidates=ALGORITHM_NAMES,
             input=token.algorithm,
             fullscreen=False,
         )
@@ -338,30 +384,50 @@ class FreakOTP(object):
 
     def delete_tokens(self, tokens: Tuple[str], force: bool = False) -> None:
         "Delete tokens"
-        count = 0
         self.title("Delete token")
-        for token in self.find(tokens):
-            if self.verbose:
+        tokens_list = self.find(tokens)
+        if self.verbose:
+            for token in tokens_list:
                 click.secho(token.details(), fg="yellow")
-            if force or click.confirm(f"Do you want to remove {token} ?"):
-                token.delete()
-                count = count + 1
+        if not force and len(tokens_list) > 1:
+            click.echo("\n".join(str(token) for token in tokens_list))
+            answer = click.prompt(
+                f"Do you want to remove these {len(tokens_list)} tokens ? (y)es/(n)o/(i)nteractive",
+                type=click.Choice(["y", "n", "i"], case_sensitive=False),
+                default="n",
+                show_choices=False,
+            ).lower()
+            if answer == "y":
+                force = True
+            elif answer == "n":
+                tokens_list = []
+        if not force:
+            tokens_list = [token for token in tokens_list if click.confirm(f"Do you want to remove {token} ?")]
+        count = self.token_db.delete_all([token.rowid for token in tokens_list if token.rowid is not None])
         if count == 1:
             click.secho("Token deleted", fg="green")
         else:
             click.secho(f"{count} tokens deleted", fg="green")
 
     def title(self, title: str) -> None:
-        click.secho(f"{title:66}", bg="blue", fg="white", bold=True)
+        click.echo(TITLE_FORMAT.format(title))
 
     def copy_into_clipboard(self, otp: str) -> None:
         "Copy data into the clipboard"
-        if self.copy:
-            data = base64.b64encode(otp.encode("utf-8")).decode("ascii")
-            data = f"\033]52;c;{data}\a"
-            if "TMUX" in os.environ:
-                data = f"\033Ptmux;\033{data}\033\\"
-            sys.stdout.write(data)
+        # The escape sequence is only meaningful for a terminal, don't pollute pipes
+        if not self.copy or not sys.stdout.isatty():
+            return
+        # OSC 52 escape sequence, built and written as bytes
+        data = b"\033]52;c;" + b2a_base64(otp.encode("utf-8"), newline=False) + b"\a"
+        if "TMUX" in os.environ:
+            data = b"\033Ptmux;\033" + data + b"\033\\"
+        sys.stdout.flush()
+        buffer = getattr(sys.stdout, "buffer", None)
+        if buffer is not None:
+            buffer.write(data)
+            buffer.flush()
+        else:  # text only stream
+            sys.stdout.write(data.decode("ascii"))
             sys.stdout.flush()
 
 
@@ -489,8 +555,8 @@ def cmd_edit(ctx: Context, tokens: Tuple[str]) -> None:
 
 
 @cli.command(".add")
-@click.option("--type", "type_str", help="Token type", type=click.Choice(TokenType._member_names_), default=TokenType.TOTP.value)
-@click.option("-a", "--algorithm", help="Algorithm", type=click.Choice(list(ALGORITHMS)), default=DEFAULT_ALGORITHM)
+@click.option("--type", "type_str", help="Token type", type=click.Choice(TOKEN_TYPES), default=TokenType.TOTP.value)
+@click.option("-a", "--algorithm", help="Algorithm", type=click.Choice(ALGORITHM_NAMES), default=DEFAULT_ALGORITHM)
 @click.option("-c", "--counter", help="HOTP counter value", type=click.INT)
 @click.option("-d", "--digits", help="Number of digits in one-time password", type=click.INT, default=DEFAULT_DIGITS)
 @click.option("-i", "--issuer", help="Issuer")
@@ -536,7 +602,25 @@ def cmd_add(
 def cmd_default(ctx: Context, tokens: Tuple[str]) -> None:
     freak = ctx.obj
     if tokens:
-        for i, token in enumerate(freak.find(tokens)):
+        # Numeric arguments are token rowids (as displayed by the menu and .ls -l),
+        # the others are searched in the token names.
+        # The tokens are listed in argument order, each token only once.
+        tokens_list: List[Token] = []
+        rowids: Set[int] = set()
+        for arg in tokens:
+            matches: List[Token] = []
+            if arg.isdecimal():
+                try:
+                    matches = [freak.get_token_by_rowid(int(arg))]
+                except KeyError:
+                    pass
+            for token in matches or freak.find(arg):
+                if token.rowid is not None:
+                    if token.rowid in rowids:
+                        continue
+                    rowids.add(token.rowid)
+                tokens_list.append(token)
+        for i, token in enumerate(tokens_list):
             if freak.counter is not None and token.type == TokenType.HOTP:
                 token.counter = freak.counter
             if freak.verbose:
@@ -555,10 +639,11 @@ def cmd_default(ctx: Context, tokens: Tuple[str]) -> None:
 def cmd_help(ctx: Context, cmds: Tuple[str]) -> None:
     """Show help and exit"""
     if cmds:
+        commands = ctx.parent.command.commands
         for cmd in cmds:
-            command: Optional[click.Command] = ctx.parent.command.get_command(ctx=ctx.parent, cmd_name=cmd)
+            command: Optional[click.Command] = commands.get(cmd)
             if command is not None:
-                click.echo(command.get_help(ctx=ctx), color=ctx.color)
+                click.echo(command.get_help(click.Context(command, info_name=cmd, parent=ctx.parent)), color=ctx.color)
     else:
         click.echo(ctx.parent.get_help(), color=ctx.color)
     ctx.exit()
@@ -572,8 +657,15 @@ def main(argv: Optional[List[str]] = None) -> int:
         args = None
         prog_name = "freakotp"
     try:
-        cli(prog_name=prog_name, args=args)
-        return EXIT_SUCCESS
+        # Not in standalone mode, Click returns instead of raising SystemExit on success
+        result = cli(prog_name=prog_name, args=args, standalone_mode=False)
+        return result if isinstance(result, int) else EXIT_SUCCESS
+    except click.ClickException as ex:
+        ex.show()
+        return ex.exit_code
+    except click.Abort:
+        click.echo("Aborted!", err=True)
+        return EXIT_FAILURE
     except SystemExit as err:
         return err.code
     except Exception as ex:
@@ -24,6 +24,7 @@
 #
 
 import base64
+from array import array
 from typing import Any, List
 
 __all__ = ["Secret"]
@@ -35,7 +36,11 @@ class Secret:
 
     @classmethod
     def from_int_list(cls, secret: List[int]) -> "Secret":
-        return Secret(bytes([(x + 256) % 256 for x in secret]))
+        try:
+            # Java signed bytes, reinterpreted as unsigned by the int8 array
+            return Secret(array("b", secret).tobytes())
+        except OverflowError:  # values above 127
+            return Secret(bytes([x & 0xFF for x in secret]))
 
     @classmethod
     def from_base32(cls, secret: str) -> "Secret":
@@ -59,7 +59,9 @@ insert into token(type, algo, counter, digits, issuer_int, issuer_ext, label, pe
 values(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
 """
 SQL_DELETE = "delete from token where rowid=?"
-SQL_SELECT_TOKENS = f"select {','.join(TOKEN_COLUMNS)} from token"
+SQL_SELECT_TOKENS = f"select {','.join(TOKEN_COLUMNS)} from token order by rowid"
+SQL_SELECT_TOKEN_AT = f"select {','.join(TOKEN_COLUMNS)} from token order by rowid limit 1 offset ?"
+SQL_SELECT_TOKEN_BY_ROWID = f"select {','.join(TOKEN_COLUMNS)} from token where rowid=?"
 SQL_UPDATE = """
 update token
 set
@@ -77,3 +79,18 @@ set
     secret=?
 where rowid=?
 """
+# Token name, the same as str(Token)
+SQL_TOKEN_NAME = """
+case
+    when coalesce(nullif(issuer_int, ''), nullif(issuer_ext, '')) is not null
+        then trim(coalesce(nullif(issuer_int, ''), issuer_ext)) || ':' || trim(label)
+    when nullif(label, '') is not null then trim(label)
+    else '#' || rowid
+end"""
+# Tokens with a name containing any of the given lowercase strings (placeholder: one "instr" condition for each string)
+SQL_SELECT_TOKENS_BY_NAME = f"""
+select {','.join(TOKEN_COLUMNS)} from (select rowid, *, lower({SQL_TOKEN_NAME}) as name from token)
+where {{}}
+order by rowid
+"""
+SQL_TOKEN_NAME_CONTAINS = "instr(name, ?) > 0"
@@ -23,10 +23,8 @@
 # SOFTWARE.
 #
 
-import hashlib
 import hmac
 import json
-import math
 import sqlite3
 import struct
 import time
@@ -35,10 +33,9 @@ from contextlib import closing
 from datetime import datetime
 from enum import Enum
 from pathlib import Path
-from typing import Dict, List, Optional, Union, cast
+from typing import Dict, List, Optional, Sequence, Union, cast
 
 import click
-import qrcode
 
 from .secret import Secret
 from .sql import (
@@ -46,7 +43,11 @@ from .sql import (
     SQL_DELETE,
     SQL_DROP_TABLE,
     SQL_INSERT,
+    SQL_SELECT_TOKEN_AT,
+    SQL_SELECT_TOKEN_BY_ROWID,
     SQL_SELECT_TOKENS,
+    SQL_SELECT_TOKENS_BY_NAME,
+    SQL_TOKEN_NAME_CONTAINS,
     SQL_UPDATE,
     TOKEN_COLUMNS,
 )
@@ -55,6 +56,7 @@ __all__ = [
     "Token",
     "TokenDb",
     "TokenType",
+    "TOKEN_TYPE_BY_NAME",
     "ALGORITHMS",
     "DEFAULT_PERIOD",
     "DEFAULT_ALGORITHM",
@@ -62,15 +64,22 @@ __all__ = [
 ]
 
 ALGORITHMS = {
-    "SHA1": hashlib.sha1,
-    "SHA256": hashlib.sha256,
-    "SHA512": hashlib.sha512,
-    "MD5": hashlib.md5,
+    "SHA1": "sha1",
+    "SHA256": "sha256",
+    "SHA512": "sha512",
+    "MD5": "md5",
 }
 
 DEFAULT_PERIOD = 30
 DEFAULT_ALGORITHM = "SHA1"
 DEFAULT_DIGITS = 6
+# Powers of ten for the OTP modulus, the truncated code is at most 2^31 - 1 (10 digits)
+_POW10 = tuple(10**i for i in range(11))
+# SQLite rowids are signed 64-bit integers
+_MIN_ROWID = -(2**63)
+_MAX_ROWID = 2**63 - 1
+_PACK_COUNTER = struct.Struct(">q").pack
+_UNPACK_CODE = struct.Struct(">L").unpack_from
 
 JsonData = Dict[str, Union[str, int, List[int], None]]
 
@@ -81,6 +90,10 @@ class TokenType(Enum):
     SECURID = "SecurID"
 
 
+# Plain dict lookup, faster than TokenType[name] when loading many tokens
+TOKEN_TYPE_BY_NAME: Dict[str, TokenType] = dict(TokenType.__members__)
+
+
 class EncodeType(Enum):
     BASE32 = "BASE32"
     HEX = "HEX"
@@ -88,7 +101,30 @@ class EncodeType(Enum):
 
 
 class Token:
-    data: Union[str, JsonData, None] = None
+    __slots__ = (
+        "data",
+        "token_db",
+        "rowid",
+        "type",
+        "_algorithm",
+        "_digest_name",
+        "counter",
+        "_digits",
+        "_modulus",
+        "_fmt",
+        "issuer_int",
+        "issuer_ext",
+        "issuer",
+        "label",
+        "period",
+        "exp_date",
+        "pin",
+        "serial",
+        "_secret",
+        "_hmac",
+    )
+    data: Union[str, JsonData, None]
+    _hmac: Optional["hmac.HMAC"]
 
     def __init__(
         self,
@@ -110,6 +146,7 @@ class Token:
         secret: Optional[Secret] = None,
         token_db: Optional["TokenDb"] = None,
     ) -> None:
+        self.data = None
         self.token_db = token_db
         self.rowid = rowid
         self.type = type
@@ -141,7 +178,7 @@ class Token:
     def _parse_data(self, data: JsonData) -> None:
         self.data = data
         self.rowid = cast(Optional[int], data.get("rowid"))
-        self.type = TokenType[cast(str, data.get("type")).upper()]
+        self.type = TOKEN_TYPE_BY_NAME[cast(str, data.get("type")).upper()]
         self.algorithm = cast(str, data.get("algo")) or DEFAULT_ALGORITHM
         self.counter = cast(int, data.get("counter"))
         self.digits = cast(int, data.get("digits")) or DEFAULT_DIGITS
@@ -150,7 +187,7 @@ class Token:
         self.issuer = self.issuer_int or self.issuer_ext
         self.label = cast(str, data.get("label"))
         self.period = cast(int, data.get("period")) or DEFAULT_PERIOD
-        self.exp_data = cast(str, data.get("exp_date"))
+        self.exp_date = cast(str, data.get("exp_date"))
         self.pin = cast(str, data.get("pin"))
         self.serial = cast(str, data.get("serial"))
         self.secret = Secret.from_base32(cast(str, data["secret"]))
@@ -160,10 +197,10 @@ class Token:
         query = dict(urllib.parse.parse_qsl(uri_components.query))
         self.rowid = None
         try:
-            self.type = TokenType[uri_components.netloc.upper()]
+            self.type = TOKEN_TYPE_BY_NAME[uri_components.netloc.upper()]
         except Exception:
             raise Exception("Error parsing URI, invalid token type")
-        self.algorithm = query.get("algorithm") or DEFAULT_ALGORITHM
+        self.algorithm = (query.get("algorithm") or DEFAULT_ALGORITHM).upper()
         self.counter = int(cast(str, query.get("counter"))) if "counter" in query else 0
         self.digits = int(cast(str, query.get("digits"))) if "digest" in query else DEFAULT_DIGITS
         if ":" in uri_components.path:
@@ -181,24 +218,76 @@ class Token:
         self.serial = None
         self.secret = Secret.from_base32(cast(str, query.get("secret")))
 
+    @property
+    def algorithm(self) -> str:
+        return self._algorithm
+
+    @algorithm.setter
+    def algorithm(self, algorithm: str) -> None:
+        self._algorithm = algorithm
+        self._digest_name = ALGORITHMS.get(algorithm, "sha1")
+        self._hmac = None
+
+    @property
+    def digits(self) -> int:
+        return self._digits
+
+    @digits.setter
+    def digits(self, digits: int) -> None:
+        self._digits = digits
+        self._modulus = _POW10[min(digits, 10)]
+        self._fmt = f"{{:0{digits}d}}"
+
+    @property
+    def secret(self) -> Secret:
+        return self._secret
+
+    @secret.setter
+    def secret(self, secret: Secret) -> None:
+        self._secret = secret
+        self._hmac = None
+
     def calculate(self, timestamp: Optional[Union[int, datetime]] = None, counter: Optional[int] = None) -> str:
+        """
+        Calculate the OTP
+
+        The digest is passed to hmac by name, so the HMAC is computed by OpenSSL
+        using the SHA extensions (SHA-NI, ARMv8 crypto) when the CPU supports them.
+        """
         if self.type == TokenType.SECURID:
             return self._calculate_securid()
-        algorithm = ALGORITHMS.get(self.algorithm, hashlib.sha1)
+        return self._otp(self._counter(timestamp, counter))
+
+    def _counter(self, timestamp: Optional[Union[int, datetime]], counter: Optional[int]) -> int:
+        "HOTP counter or TOTP time step"
         if self.type == TokenType.HOTP:
-            value = counter if counter is not None else self.counter
+            return counter if counter is not None else self.counter
         elif timestamp is not None and isinstance(timestamp, datetime):
-            value = timestamp.timestamp() // self.period
+            return int(timestamp.timestamp()) // self.period
         elif timestamp is not None:
-            value = timestamp // self.period
+            return int(timestamp) // self.period
         else:
-            value = int(int(time.time()) / self.period)
-        t = struct.pack(">q", int(value))
-        hmac_ = hmac.HMAC(self.secret.to_bytes(), t, algorithm).digest()
+            return time.time_ns() // (self.period * 1_000_000_000)
+
+    def _otp(self, value: int) -> str:
+        "Calculate the OTP for a counter value"
+        h = self._keyed_hmac().copy()
+        h.update(_PACK_COUNTER(value))
+        hmac_ = h.digest()
         offset = hmac_[-1] & 0x0F
-        code = struct.unpack(">L", hmac_[offset : offset + 4])[0]
-        frmt = "{0:0%dd}" % self.digits
-        return frmt.format((code & 0x7FFFFFFF) % int(math.pow(10, self.digits)))
+        code = _UNPACK_CODE(hmac_, offset)[0]
+        return self._fmt.format((code & 0x7FFFFFFF) % self._modulus)
+
+    def _keyed_hmac(self) -> "hmac.HMAC":
+        """
+        Return an HMAC object already keyed with the token secret
+
+        The inner and outer key states are computed once per secret/algorithm,
+        each OTP only copies them and hashes the counter.
+        """
+        if self._hmac is None:
+            self._hmac = hmac.new(self._secret.to_bytes(), digestmod=self._digest_name)
+        return self._hmac
 
     def time_left(self, for_time: Union[int, datetime, None] = None) -> int:
         """
@@ -268,7 +357,7 @@ class Token:
             data["period"] = self.period
         if self.type == TokenType.HOTP:
             data["counter"] = self.counter
-        data["secret"] = self.secret.to_base32()
+        data["secret"] = self.secret.to_base32().rstrip("=")  # padding is omitted in otpauth URIs
         if self.issuer:
             label = f"{self.issuer.strip()}:{self.label.strip()}"
         elif self.label:
@@ -286,6 +375,8 @@ class Token:
 
     def print_qrcode(self, invert: bool = True) -> None:
         "Print token as qrcode"
+        import qrcode
+
         click.secho(f"{self}", fg="green")
         qr = qrcode.QRCode()
         qr.add_data(self.to_uri())
@@ -311,6 +402,8 @@ class TokenDb:
     def __init__(self, filename: Path) -> None:
         self.filename = filename
         self.filename.parent.mkdir(parents=True, exist_ok=True)
+        self._tokens: Optional[List[Token]] = None
+        self._tokens_mtime_ns: Optional[int] = None
 
     def open_db(self) -> sqlite3.Connection:
         try:
@@ -321,14 +414,102 @@ class TokenDb:
             cursor.execute(SQL_CREATE_TABLE)
         return connection
 
+    def _mtime_ns(self) -> Optional[int]:
+        "Database file modification time"
+        try:
+            return self.filename.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _cached_tokens(self) -> Optional[List[Token]]:
+        "Cached token list, None if not loaded or if the database was modified (e.g. by another process)"
+        if self._tokens is not None and self._tokens_mtime_ns != self._mtime_ns():
+            self._tokens = None
+        return self._tokens
+
     def get_tokens(self) -> List[Token]:
-        result: List[Token] = []
+        "Get all the tokens, the list is cached until the database is modified"
+        tokens = self._cached_tokens()
+        if tokens is None:
+            self._tokens_mtime_ns = self._mtime_ns()
+            result: List[Token] = []
+            with closing(self.open_db()) as connection:
+                with closing(connection.cursor()) as cursor:
+                    rows = cursor.execute(SQL_SELECT_TOKENS).fetchall()
+                    for values in rows:
+                        data = dict(zip(TOKEN_COLUMNS, values))
+                        result.append(Token(data, token_db=self))
+            self._tokens = tokens = result
+        return tokens
+
+    def find_by_name(self, labels: Sequence[str]) -> List[Token]:
+        """
+        Get the tokens with a name containing any of the given labels (case insensitive)
+
+        The search runs in SQLite, unless the tokens are already loaded.
+        """
+        labels = [label.lower() for label in labels]
+        if not labels:
+            return []
+        if self._cached_tokens() is not None or not all(label.isascii() for label in labels):
+            # SQLite lower() only handles ASCII characters
+            names = [(token, str(token).lower().strip()) for token in self.get_tokens()]
+            return [token for token, name in names if any(label in name for label in labels)]
+        sql = SQL_SELECT_TOKENS_BY_NAME.format(" or ".join([SQL_TOKEN_NAME_CONTAINS] * len(labels)))
+        with closing(self.open_db()) as connection:
+            with closing(connection.cursor()) as cursor:
+                rows = cursor.execute(sql, labels).fetchall()
+        return [Token(dict(zip(TOKEN_COLUMNS, values)), token_db=self) for values in rows]
+
+    def get_token_at(self, index: int) -> Optional[Token]:
+        "Get a token by position (1-based), without loading all the tokens"
+        if index < 1:
+            return None
+        tokens = self._cached_tokens()
+        if tokens is not None:
+            return tokens[index - 1] if index <= len(tokens) else None
         with closing(self.open_db()) as connection:
             with closing(connection.cursor()) as cursor:
-                rows = cursor.execute(SQL_SELECT_TOKENS).fetchall()
-                for values in rows:
-                    data = dict(zip(TOKEN_COLUMNS, values))
-                    result.append(Token(data, token_db=self))
+                values = cursor.execute(SQL_SELECT_TOKEN_AT, [index - 1]).fetchone()
+        return Token(dict(zip(TOKEN_COLUMNS, values)), token_db=self) if values else None
+
+    def get_token_by_rowid(self, rowid: int) -> Optional[Token]:
+        "Get a token by rowid (the number displayed by the menu and .ls -l)"
+        if not _MIN_ROWID <= rowid <= _MAX_ROWID:
+            return None
+        tokens = self._cached_tokens()
+        if tokens is not None:
+            return next((token for token in tokens if token.rowid == rowid), None)
+        with closing(self.open_db()) as connection:
+            with closing(connection.cursor()) as cursor:
+                values = cursor.execute(SQL_SELECT_TOKEN_BY_ROWID, [rowid]).fetchone()
+        return Token(dict(zip(TOKEN_COLUMNS, values)), token_db=self) if values else None
+
+    def calculate_all(
+        self,
+        tokens: Optional[List[Token]] = None,
+        timestamp: Optional[Union[int, datetime]] = None,
+        counter: Optional[int] = None,
+    ) -> List[Optional[str]]:
+        """
+        Calculate the OTPs for a list of tokens (default: all the tokens)
+
+        The timestamp is resolved once for the whole batch.
+
+        :returns: the OTPs, None for the tokens that can't be calculated
+        """
+        if tokens is None:
+            tokens = self.get_tokens()
+        if timestamp is None:
+            timestamp = time.time_ns() // 1_000_000_000
+        elif isinstance(timestamp, datetime):
+            timestamp = int(timestamp.timestamp())
+        result: List[Optional[str]] = []
+        for token in tokens:
+            try:
+                result.append(token.calculate(timestamp=timestamp, counter=counter))
+            except ImportError:  # SecurID support not installed
+                result.append(None)
         return result
 
     def delete(self, rowid: int) -> None:
@@ -337,6 +518,18 @@ class TokenDb:
             with closing(connection.cursor()) as cursor:
                 cursor.execute(SQL_DELETE, [rowid])
                 connection.commit()
+        self._tokens = None
+
+    def delete_all(self, rowids: Sequence[int]) -> int:
+        "Delete tokens by rowid in a single transaction"
+        if not rowids:
+            return 0
+        with closing(self.open_db()) as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.executemany(SQL_DELETE, [[rowid] for rowid in rowids])
+                connection.commit()
+        self._tokens = None
+        return len(rowids)
 
     def insert(self, token: Token) -> None:
         "Insert a token into the database"
@@ -360,6 +553,7 @@ class TokenDb:
                     ),
                 )
                 connection.commit()
+        self._tokens = None
 
     def update(self, token: Token) -> None:
         "Update a token in the database"
@@ -384,6 +578,7 @@ class TokenDb:
                     ),
                 )
                 connection.commit()
+        self._tokens = None
 
     def truncate(self) -> None:
         "Delete all the tokens"
@@ -392,39 +587,42 @@ class TokenDb:
                 cursor.execute(SQL_DROP_TABLE)
                 cursor.execute(SQL_CREATE_TABLE)
                 connection.commit()
+        self._tokens = None
 
     def import_json(self, json_filename: Path, delete_existing_data: bool = False) -> int:
         "Import FreeOTP backup into FreakOTP database"
-        with json_filename.open("r") as f:
-            self.data = json.loads(f.read())
-        count = 0
+        try:  # orjson is optional and only needed here, don't load it at startup
+            from orjson import loads as json_loads
+        except ImportError:
+            json_loads = json.loads  # type: ignore
+        self.data = json_loads(json_filename.read_bytes())
+        rows = [
+            (
+                token.get("type"),
+                token.get("algo") or DEFAULT_ALGORITHM,
+                token.get("counter"),
+                token.get("digits") or DEFAULT_DIGITS,
+                token.get("issuerInt"),
+                token.get("issuerExt"),
+                token.get("label"),
+                token.get("period") or DEFAULT_PERIOD,
+                token.get("exp_date"),
+                token.get("pin"),
+                token.get("serial"),
+                Secret.from_int_list(token["secret"]).to_base32(),
+            )
+            for token in self.data["tokens"]
+        ]
         with closing(self.open_db()) as connection:
             with closing(connection.cursor()) as cursor:
                 if delete_existing_data:
                     cursor.execute(SQL_DROP_TABLE)
                 cursor.execute(SQL_CREATE_TABLE)
-                for token in self.data["tokens"]:
-                    secret = Secret.from_int_list(token["secret"])
-                    cursor.execute(
-                        SQL_INSERT,
-                        (
-                            token.get("type"),
-                            token.get("algo") or DEFAULT_ALGORITHM,
-                            token.get("counter"),
-                            token.get("digits") or DEFAULT_DIGITS,
-                            token.get("issuerInt"),
-                            token.get("issuerExt"),
-                            token.get("label"),
-                            token.get("period") or DEFAULT_PERIOD,
-                            token.get("exp_date"),
-                            token.get("pin"),
-                            token.get("serial"),
-                            secret.to_base32(),
-                        ),
-                    )
-                    count = count + 1
+                # Insert all the tokens with a single statement and commit
+                cursor.executemany(SQL_INSERT, rows)
                 connection.commit()
-        return count
+        self._tokens = None
+        return len(rows)
 
     def export_json(self, json_filename: Path) -> int:
         "Export FreeOTP database using FreeOTP backup format"
@@ -440,6 +638,11 @@ class TokenDb:
             tokens.append(token)
         token_order: List[str] = [f"{token['issuerInt']}:{token['label']}" for token in tokens]
         result = {"tokenOrder": token_order, "tokens": tokens}
-        with json_filename.open("w") as f:
-            json.dump(result, f, indent=2)
+        try:
+            import orjson
+
+            json_filename.write_bytes(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+        except ImportError:
+            with json_filename.open("w") as f:
+                json.dump(result, f, indent=2)
         return len(tokens)
@@ -0,0 +1,13 @@
+from pathlib import Path
+
+import pytest
+
+DB_PATH = Path(__file__).parent / 'test.db'
+
+
+@pytest.fixture
+def db_copy(tmp_path):
+    "Scratch copy of test.db, for the tests modifying the database"
+    db_path = tmp_path / 'test.db'
+    db_path.write_bytes(DB_PATH.read_bytes())
+    return db_path
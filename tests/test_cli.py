@@ -1,7 +1,11 @@
 import shlex
+import sys
 from pathlib import Path
 
-from freakotp.cli import EXIT_PARSER_ERROR, EXIT_SUCCESS, main
+import pytest
+from click.testing import CliRunner
+
+from freakotp.cli import EXIT_PARSER_ERROR, EXIT_SUCCESS, FreakOTP, cli, main
 
 DB_PATH = Path(__file__).parent / 'test.db'
 
@@ -37,3 +41,79 @@ def test_help():
     r(".help")
     r("--help")
     r("-h", EXIT_PARSER_ERROR)
+    r(".nope", EXIT_PARSER_ERROR)
+
+
+def test_find(db_copy):
+    freak = FreakOTP(db_filename=db_copy, copy=False)
+    assert [str(token) for token in freak.find("ATOM")] == ["built:atom"]
+    assert [str(token) for token in freak.find(["atom", "ROOF"])] == ["roof:toll", "built:atom"]
+    freak.delete_tokens(["atom"], force=True)
+    assert freak.find("atom") == []
+    assert len(freak.find("o")) > 0
+
+
+@pytest.mark.parametrize(
+    "answers, remaining",
+    [
+        ("y\n", []),
+        ("n\n", ["roof:toll", "mental:suggestion", "built:atom"]),
+        ("i\ny\nn\ny\n", ["mental:suggestion"]),
+    ],
+)
+def test_delete_prompt(db_copy, answers, remaining):
+    labels = ["roof", "mental", "atom"]
+    result = CliRunner().invoke(cli, ["--db", str(db_copy), ".delete", *labels], input=answers)
+    assert result.exit_code == 0
+    assert [str(token) for token in FreakOTP(db_filename=db_copy).find(labels)] == remaining
+
+
+def test_help_command(capsys):
+    r(".help .ls .otp")
+    out = capsys.readouterr().out
+    assert "Usage: freakotp .ls [OPTIONS]" in out
+    assert "Usage: freakotp .otp [OPTIONS]" in out
+
+
+def test_default(capsys):
+    r("--no-copy -t 2020-01-01T00:00:00 atom")
+    atom = capsys.readouterr().out
+    r("--no-copy -t 2020-01-01T00:00:00 20")
+    assert capsys.readouterr().out == atom
+    r("--no-copy -t 2020-01-01T00:00:00 meal")
+    meal = capsys.readouterr().out
+    r("--no-copy -t 2020-01-01T00:00:00 5 meal")
+    assert capsys.readouterr().out == meal
+    r("--no-copy -t 2020-01-01T00:00:00 atom 5")
+    assert capsys.readouterr().out == atom + meal
+    r("--no-copy -t 2020-01-01T00:00:00 99")
+    assert capsys.readouterr().out == ""
+    r("--no-copy -t 2020-01-01T00:00:00 99999999999999999999")
+    assert capsys.readouterr().out == ""
+    r("--no-copy -t 2020-01-01T00:00:00 ²")
+    assert capsys.readouterr().out == ""
+
+
+def test_default_rowid(db_copy, capsys):
+    FreakOTP(db_filename=db_copy).delete_tokens(["roof:toll"], force=True)
+    capsys.readouterr()
+    prefix = f"freakotp --db {db_copy} --no-copy -t 2020-01-01T00:00:00 "
+    for label, rowid in (("design:meal", 5), ("built:atom", 20)):
+        assert main(shlex.split(prefix + label)) == EXIT_SUCCESS
+        by_label = capsys.readouterr().out
+        assert by_label
+        assert main(shlex.split(prefix + str(rowid))) == EXIT_SUCCESS
+        assert capsys.readouterr().out == by_label
+
+
+def test_copy_into_clipboard(capsysbinary, monkeypatch):
+    monkeypatch.delenv("TMUX", raising=False)
+    freak = FreakOTP(db_filename=DB_PATH)
+    freak.copy_into_clipboard("123456")
+    assert capsysbinary.readouterr().out == b""
+    monkeypatch.setattr(sys.stdout, "isatty", lambda: True)
+    freak.copy_into_clipboard("123456")
+    assert capsysbinary.readouterr().out == b"\033]52;c;MTIzNDU2\a"
+    monkeypatch.setenv("TMUX", "1")
+    freak.copy_into_clipboard("123456")
+    assert capsysbinary.readouterr().out == b"\033Ptmux;\033\033]52;c;MTIzNDU2\a\033\\"
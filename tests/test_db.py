@@ -0,0 +1,94 @@
+from pathlib import Path
+
+from freakotp.secret import Secret
+from freakotp.token import Token, TokenDb
+
+DB_PATH = Path(__file__).parent / 'test.db'
+BACKUP_PATH = Path(__file__).parent.parent / 'freeotp-backup.json'
+
+
+def test_calculate_all():
+    token_db = TokenDb(DB_PATH)
+    tokens = token_db.get_tokens()
+    otps = token_db.calculate_all(tokens, timestamp=1111111109)
+    assert len(otps) == len(tokens)
+    for token, otp in zip(tokens, otps):
+        assert otp == token.calculate(timestamp=1111111109)
+    assert token_db.calculate_all(timestamp=1111111109) == otps
+
+
+def test_import_export(tmp_path):
+    token_db = TokenDb(tmp_path / 'test.db')
+    assert token_db.import_json(BACKUP_PATH) == 2
+    tokens = token_db.get_tokens()
+    assert [str(token) for token in tokens] == ["redButton:Donald", "redButton:Vladimir"]
+    assert tokens[0].secret.to_int_list() == [0] * 10
+    assert token_db.export_json(tmp_path / 'backup.json') == 2
+    assert token_db.import_json(tmp_path / 'backup.json', delete_existing_data=True) == 2
+    assert [str(token) for token in token_db.get_tokens()] == ["redButton:Donald", "redButton:Vladimir"]
+
+
+def test_tokens_cache(tmp_path):
+    token_db = TokenDb(tmp_path / 'test.db')
+    assert token_db.get_tokens() == []
+    token_db.insert(Token(issuer="issuer", label="label", secret=Secret.from_hex("00" * 10)))
+    tokens = token_db.get_tokens()
+    assert [str(token) for token in tokens] == ["issuer:label"]
+    assert token_db.get_tokens() is tokens
+    tokens[0].label = "other"
+    token_db.update(tokens[0])
+    assert [str(token) for token in token_db.get_tokens()] == ["issuer:other"]
+    token_db.get_tokens()[0].delete()
+    assert token_db.get_tokens() == []
+
+
+def test_tokens_cache_other_instance(tmp_path):
+    token_db = TokenDb(tmp_path / 'test.db')
+    other_db = TokenDb(tmp_path / 'test.db')
+    assert token_db.get_tokens() == []
+    assert token_db.get_token_by_rowid(1) is None
+    other_db.insert(Token(issuer="issuer", label="label", secret=Secret.from_hex("00" * 10)))
+    assert [str(token) for token in token_db.get_tokens()] == ["issuer:label"]
+    assert str(token_db.get_token_by_rowid(1)) == "issuer:label"
+    other_db.get_tokens()[0].delete()
+    assert token_db.get_tokens() == []
+    assert token_db.get_token_at(1) is None
+
+
+def test_get_token_at():
+    token_db = TokenDb(DB_PATH)
+    assert str(token_db.get_token_at(1)) == "roof:toll"
+    assert str(token_db.get_token_at(20)) == "built:atom"
+    assert token_db.get_token_at(0) is None
+    assert token_db.get_token_at(21) is None
+    tokens = token_db.get_tokens()
+    assert token_db.get_token_at(20) is tokens[19]
+    assert token_db.get_token_at(21) is None
+
+
+def test_get_token_by_rowid(db_copy):
+    token_db = TokenDb(db_copy)
+    token_db.delete(1)
+    assert str(token_db.get_token_by_rowid(5)) == "design:meal"
+    assert str(token_db.get_token_by_rowid(20)) == "built:atom"
+    assert token_db.get_token_by_rowid(1) is None
+    assert token_db.get_token_by_rowid(21) is None
+    assert token_db.get_token_by_rowid(2**64) is None
+    tokens = token_db.get_tokens()
+    assert token_db.get_token_by_rowid(20) is tokens[18]
+    assert token_db.get_token_by_rowid(1) is None
+
+
+def test_find_by_name(tmp_path):
+    token_db = TokenDb(tmp_path / 'test.db')
+    secret = Secret.from_hex("00" * 10)
+    token_db.insert(Token(issuer="Issuer", label="Label", secret=secret))
+    token_db.insert(Token(issuer_ext=" Ext ", label=" Other ", secret=secret))
+    token_db.insert(Token(label="NoIssuer", secret=secret))
+    token_db.insert(Token(secret=secret))
+    for labels in (["issuer"], ["LABEL"], ["ext:other"], ["r:l"], ["noissuer", "#4"], ["e"], ["x"], []):
+        token_db._tokens = None
+        sql = [token.rowid for token in token_db.find_by_name(labels)]
+        token_db.get_tokens()
+        assert [token.rowid for token in token_db.find_by_name(labels)] == sql
+    assert [str(token) for token in TokenDb(DB_PATH).find_by_name(["atom", "ROOF"])] == ["roof:toll", "built:atom"]
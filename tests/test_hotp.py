@@ -34,3 +34,14 @@ def test_rfc4226_test_vectors():
     for test in tests:
         token = Token(type=TokenType.HOTP, algorithm="SHA1", digits=6, secret=secret)
         assert token.calculate(counter=test[0]) == test[1]
+
+
+def test_secret_change():
+    token = Token(type=TokenType.HOTP, algorithm="SHA1", digits=6, secret=Secret.from_hex(SECRET))
+    assert token.calculate(counter=0) == "755224"
+    token.secret = Secret.from_hex("00" * 20)
+    assert token.calculate(counter=0) != "755224"
+    token.secret = Secret.from_hex(SECRET)
+    assert token.calculate(counter=0) == "755224"
+    token.algorithm = "SHA256"
+    assert token.calculate(counter=0) != "755224"
@@ -100,3 +100,8 @@ def test_secrets_with_spaces():
     assert s1 == s3
     s4 = Secret.from_hex(SECRET_WITH_SPACES4)
     assert s1 == s4
+
+
+def test_secrets_signed_int_list():
+    s1 = Secret.from_int_list([-1, -128, 0, 127, 255])
+    assert s1.to_int_list() == [255, 128, 0, 127, 255]
@@ -0,0 +1,26 @@
+from freakotp.secret import Secret
+from freakotp.token import Token, TokenType
+
+
+def test_uri():
+    token = Token(type=TokenType.TOTP, issuer="issuer", label="label", secret=Secret.from_hex("0102030405"))
+    uri = token.to_uri()
+    assert uri == "otpauth://totp/issuer:label?algorithm=SHA1&digits=6&period=30&secret=AEBAGBAF"
+    token2 = Token(uri=uri)
+    assert str(token2) == "issuer:label"
+    assert token2.secret == token.secret
+    token = Token(type=TokenType.HOTP, label="label", counter=5, secret=Secret.from_hex("01020304"))
+    uri = token.to_uri()
+    assert uri == "otpauth://hotp/label?algorithm=SHA1&digits=6&counter=5&secret=AEBAGBA"
+    token2 = Token(uri=uri)
+    assert token2.type == TokenType.HOTP
+    assert token2.counter == 5
+    assert token2.secret == token.secret
+
+
+def test_data():
+    data = {"type": "SECURID", "algo": "SHA1", "digits": 8, "period": 60, "exp_date": "2035-12-31", "secret": "AEBAGBAF"}
+    token = Token(data)
+    assert token.type == TokenType.SECURID
+    assert token.exp_date == "2035-12-31"
+    assert token.to_dict()["exp_date"] == "2035-12-31"
@@ -1,3 +1,5 @@
+from datetime import datetime, timezone
+
 from freakotp.secret import Secret
 from freakotp.token import Token, TokenType
 
@@ -61,3 +63,21 @@ def test_rfc6238_test_vectors():
     for test in tests:
         token = Token(type=TokenType.TOTP, algorithm=test[3], digits=len(test[2]), secret=SECRETS[test[3]])
         assert token.calculate(timestamp=test[0]) == test[2]
+
+
+def test_uri_algorithm_case():
+    uri = "otpauth://totp/test?secret=GEZDGNBVGY3TQOJQGEZDGNBVGY3TQOJQGEZDGNBVGY3TQOJQGEZA&algorithm=sha256&digits=8"
+    token = Token(uri=uri)
+    assert token.algorithm == "SHA256"
+    assert token.calculate(timestamp=59)[-6:] == "119246"
+
+
+def test_datetime_timestamp():
+    token = Token(type=TokenType.TOTP, algorithm="SHA1", digits=8, secret=SECRETS["SHA1"])
+    timestamp = datetime.fromtimestamp(1111111109, timezone.utc)
+    assert token.calculate(timestamp=timestamp) == token.calculate(timestamp=1111111109) == "07081804"
+
+
+def test_float_timestamp():
+    token = Token(type=TokenType.TOTP, algorithm="SHA1", digits=8, secret=SECRETS["SHA1"])
+    assert token.calculate(timestamp=1111111109.5) == "07081804"